@@ -1,25 +1,45 @@
 """
 Azure Document Intelligence Demo - Streamlit Application
 """
+import hashlib
 import streamlit as st
 import io
+import fitz
+import numpy as np
 from PIL import Image
-from pdf2image import convert_from_bytes
 import pandas as pd
 from datetime import datetime
 
 from config import get_config
-from document_processor import DocumentProcessor
+from document_processor import (
+    DocumentProcessor,
+    cancel_batch_jobs,
+    cells_to_dataframe,
+    export_to_excel,
+    export_to_json,
+    poll_batch_results
+)
+
+
+# Line confidence buckets for the text view
+CONFIDENCE_THRESHOLDS = [0.6, 0.8]
+CONFIDENCE_COLORS = np.array(["🔴", "🟡", "🟢"])
 
 
 def init_session_state():
     """Initialize session state variables"""
     if "processed_data" not in st.session_state:
         st.session_state.processed_data = None
-    if "original_document" not in st.session_state:
-        st.session_state.original_document = None
     if "document_name" not in st.session_state:
         st.session_state.document_name = None
+    if "df_cache" not in st.session_state:
+        st.session_state.df_cache = None
+    if "batch_jobs" not in st.session_state:
+        st.session_state.batch_jobs = None
+    if "batch_view" not in st.session_state:
+        st.session_state.batch_view = None
+    if "upload_digest" not in st.session_state:
+        st.session_state.upload_digest = None
 
 
 def check_configuration():
@@ -36,23 +56,30 @@ def check_configuration():
     return config
 
 
-def display_document_preview(uploaded_file):
+@st.cache_data(show_spinner=False, max_entries=8)
+def _render_pdf_preview(document_digest, _document_bytes, max_pages=3):
+    """Render the first pages of a PDF as RGB arrays, memoized by document digest"""
+    images = []
+    with fitz.open(stream=_document_bytes, filetype="pdf") as pdf:
+        for page in pdf.pages(0, min(max_pages, pdf.page_count)):
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(1, 1))  # 72 DPI
+            images.append(np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(pixmap.height, pixmap.width, pixmap.n))
+    return images
+
+
+def display_document_preview(uploaded_file, document_bytes):
     """Display preview of uploaded document"""
     try:
         if uploaded_file.type == "application/pdf":
             try:
-                # Convert PDF to images for preview
-                pdf_bytes = uploaded_file.getvalue()
-                images = convert_from_bytes(pdf_bytes, first_page=1, last_page=3)  # Show first 3 pages
-
+                # Render PDF pages in-process for preview
                 st.write("**Document Preview (First 3 pages):**")
+                images = _render_pdf_preview(_upload_digest(uploaded_file, document_bytes), document_bytes)  # Show first 3 pages
                 for i, image in enumerate(images):
-                    st.image(image, caption=f"Page {i+1}", use_column_width=True)
-                    if i >= 2:  # Limit to 3 pages for preview
-                        break
+                    st.image(image, caption=f"Page {i+1}", channels="RGB", use_column_width=True)
             except Exception as pdf_error:
                 st.warning(f"PDF preview unavailable: {str(pdf_error)}")
-                st.info("📄 PDF uploaded successfully. Preview requires poppler installation.")
+                st.info("📄 PDF uploaded successfully. Preview could not be rendered.")
                 st.write(f"**File Info:**")
                 st.write(f"- Name: {uploaded_file.name}")
                 st.write(f"- Size: {uploaded_file.size / 1024:.1f} KB")
@@ -67,19 +94,92 @@ def display_document_preview(uploaded_file):
         st.error(f"Error displaying document preview: {str(e)}")
 
 
-def process_document(uploaded_file, processor):
+def _digest(data: bytes) -> str:
+    """Fingerprint bytes for use as a cache key"""
+    return hashlib.blake2b(data).hexdigest()
+
+
+def _upload_digest(uploaded_file, document_bytes):
+    """Digest of the current upload, hashed once per file rather than on every rerun"""
+    cached = st.session_state.upload_digest
+    if cached is None or cached[0] != uploaded_file.file_id:
+        cached = st.session_state.upload_digest = (uploaded_file.file_id, _digest(document_bytes))
+    return cached[1]
+
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def _analyze_cached(endpoint, key_digest, document_digest, document_type, max_pages, _key, _document_bytes, _retries):
+    """
+    Analyze a document, memoized by endpoint, key and document fingerprints.
+
+    Underscore-prefixed arguments are not hashed by Streamlit; the digests
+    stand in for them in the cache key. _retries collects the failed attempt
+    numbers, so it stays empty on a cache hit.
+    """
+    processor = DocumentProcessor(endpoint, _key)
+    # PDFs are trimmed inside the cached call, so cache hits skip it and the
+    # key is the original upload's digest
+    return processor.run(
+        processor.analyze_upload(_document_bytes, document_type, max_pages, on_retry=_retries.append)
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _to_kv_df(kv_pairs):
+    """Key-value pairs as a key/value DataFrame"""
+    return pd.DataFrame(kv_pairs, columns=["key", "value"])
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _to_table_dfs(tables):
+    """One DataFrame per table, or None for tables without cells"""
+    return [
+        cells_to_dataframe(table["cells"]) if table["cells"] else None
+        for table in tables
+    ]
+
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _to_lines_df(pages):
+    """Text lines as a content/confidence DataFrame per page number"""
+    return {
+        page["page_number"]: pd.DataFrame(page["lines"], columns=["content", "confidence"])
+        for page in pages
+    }
+
+
+def build_dataframes(data):
+    """Build the DataFrames shown in the results tabs once per analysis"""
+    return {
+        "kv": _to_kv_df(data.get("key_value_pairs", [])),
+        "tables": _to_table_dfs(data.get("tables", [])),
+        "lines": _to_lines_df(data.get("text_content", {}).get("pages", []))
+    }
+
+
+def process_document(uploaded_file, document_bytes, config, max_pages=None):
     """Process document with Azure Document Intelligence"""
     try:
         with st.spinner("🔍 Analyzing document with Azure Document Intelligence..."):
-            # Get document bytes
-            document_bytes = uploaded_file.getvalue()
-
-            # Process with Azure DI
-            result = processor.analyze_document(document_bytes)
+            # Process with Azure DI, reusing earlier results for the same document
+            retries = []
+            result = _analyze_cached(
+                config.endpoint,
+                _digest(config.key.encode()),
+                _upload_digest(uploaded_file, document_bytes),
+                uploaded_file.type,
+                max_pages,
+                config.key,
+                document_bytes,
+                retries
+            )
+            if retries:
+                st.toast(f"⏳ Azure was busy; the analysis was retried {len(retries)} time(s).")
 
             st.session_state.processed_data = result
-            st.session_state.original_document = uploaded_file
+            st.session_state.df_cache = build_dataframes(result)
             st.session_state.document_name = uploaded_file.name
+            st.session_state.batch_view = None
 
             st.success("✅ Document analysis completed!")
 
@@ -90,12 +190,97 @@ def process_document(uploaded_file, processor):
     return True
 
 
+def submit_batch(uploaded_files, config, max_pages=None):
+    """Submit several documents for analysis and remember their jobs"""
+    try:
+        with st.spinner(f"📨 Submitting {len(uploaded_files)} documents..."):
+            processor = DocumentProcessor(config.endpoint, config.key)
+            # Don't leave the previous batch running with nothing left to collect it
+            if st.session_state.batch_jobs:
+                cancel_batch_jobs(st.session_state.batch_jobs)
+            st.session_state.batch_jobs = processor.submit_batch(
+                [
+                    (uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type)
+                    for uploaded_file in uploaded_files
+                ],
+                max_pages
+            )
+            st.session_state.batch_view = None
+
+            st.success("✅ Batch submitted! Poll for results in the main panel.")
+
+    except Exception as e:
+        st.error(f"❌ Batch submission failed: {str(e)}")
+        return False
+
+    return True
+
+
+def display_batch_jobs():
+    """Display batch job status and load finished results for review"""
+    jobs = st.session_state.batch_jobs
+    if not jobs:
+        st.info("👈 Upload documents and click 'Submit Batch' to start processing")
+        return
+
+    st.header("🗂️ Batch Jobs")
+
+    if st.button("🔄 Poll Results"):
+        try:
+            with st.spinner("🔍 Checking batch status..."):
+                st.session_state.batch_jobs = jobs = poll_batch_results(jobs)
+        except Exception as e:
+            st.error(f"❌ Polling failed: {str(e)}")
+
+    st.dataframe(
+        pd.DataFrame(
+            [
+                {"id": job_id, "name": job["name"], "status": job["status"], "error": job["error"] or ""}
+                for job_id, job in jobs.items()
+            ]
+        ),
+        column_config={
+            "id": "Job",
+            "name": "Document",
+            "status": "Status",
+            "error": "Error"
+        },
+        use_container_width=True,
+        hide_index=True
+    )
+
+    finished = [job_id for job_id, job in jobs.items() if job["status"] == "succeeded"]
+    if not finished:
+        return
+
+    selected_job = st.selectbox(
+        "View results for",
+        finished,
+        format_func=lambda job_id: jobs[job_id]["name"],
+        key="batch_job_selector"
+    )
+    if st.button("👀 View Results"):
+        result = jobs[selected_job]["result"]
+        st.session_state.processed_data = result
+        st.session_state.df_cache = build_dataframes(result)
+        st.session_state.document_name = jobs[selected_job]["name"]
+        st.session_state.batch_view = selected_job
+
+    # Only show results loaded from this batch, not an earlier single-document analysis
+    if st.session_state.batch_view in finished:
+        st.header(f"🔍 Extracted Data: {st.session_state.document_name}")
+        display_results()
+        st.markdown("---")
+        create_download_section()
+
+
 def display_results():
     """Display analysis results"""
     if not st.session_state.processed_data:
         return
 
     data = st.session_state.processed_data
+    df_cache = st.session_state.df_cache
 
     # Summary metrics
     st.subheader("📊 Analysis Summary")
@@ -115,19 +300,19 @@ def display_results():
     tab1, tab2, tab3, tab4 = st.tabs(["📋 Key-Value Pairs", "📊 Tables", "📄 Text Content", "🎯 Confidence Details"])
 
     with tab1:
-        display_key_value_pairs(data.get("key_value_pairs", []))
+        display_key_value_pairs(data.get("key_value_pairs", []), df_cache["kv"])
 
     with tab2:
-        display_tables(data.get("tables", []))
+        display_tables(data.get("tables", []), df_cache["tables"])
 
     with tab3:
-        display_text_content(data.get("text_content", {}))
+        display_text_content(data.get("text_content", {}), df_cache["lines"])
 
     with tab4:
         display_confidence_details(data.get("confidence_summary", {}))
 
 
-def display_key_value_pairs(kv_pairs):
+def display_key_value_pairs(kv_pairs, kv_df):
     """Display key-value pairs in a formatted table"""
     if not kv_pairs:
         st.info("No key-value pairs found in the document.")
@@ -135,12 +320,9 @@ def display_key_value_pairs(kv_pairs):
 
     st.write(f"**Found {len(kv_pairs)} key-value pairs:**")
 
-    # Convert to DataFrame for better display
-    df = pd.DataFrame(kv_pairs)
-
     # Display without confidence columns
     st.dataframe(
-        df[["key", "value"]],
+        kv_df,
         column_config={
             "key": "Key",
             "value": "Value"
@@ -149,7 +331,7 @@ def display_key_value_pairs(kv_pairs):
     )
 
 
-def display_tables(tables):
+def display_tables(tables, table_dfs):
     """Display extracted tables"""
     if not tables:
         st.info("No tables found in the document.")
@@ -157,29 +339,17 @@ def display_tables(tables):
 
     st.write(f"**Found {len(tables)} table(s):**")
 
-    for table in tables:
+    for table, df in zip(tables, table_dfs):
         st.write(f"**Table {table['table_id']}** ({table['row_count']} rows × {table['column_count']} columns, Confidence: {table['confidence']:.1%})")
 
-        if table["cells"]:
-            # Create table matrix
-            max_row = max(cell["row_index"] for cell in table["cells"]) + 1
-            max_col = max(cell["column_index"] for cell in table["cells"]) + 1
-
-            # Initialize matrix
-            matrix = [["" for _ in range(max_col)] for _ in range(max_row)]
-
-            # Fill matrix
-            for cell in table["cells"]:
-                matrix[cell["row_index"]][cell["column_index"]] = cell["content"]
-
+        if df is not None:
             # Display as DataFrame
-            df = pd.DataFrame(matrix)
             st.dataframe(df, use_container_width=True)
 
         st.write("---")
 
 
-def display_text_content(text_data):
+def display_text_content(text_data, lines_by_page):
     """Display text content by pages"""
     if not text_data or not text_data.get("pages"):
         st.info("No text content found.")
@@ -188,19 +358,21 @@ def display_text_content(text_data):
     st.write("**Extracted Text Content:**")
 
     # Page selector
-    page_numbers = [page["page_number"] for page in text_data["pages"]]
-    selected_page = st.selectbox("Select Page", page_numbers, key="text_page_selector")
+    selected_page = st.selectbox("Select Page", list(lines_by_page), key="text_page_selector")
 
     # Find selected page data
-    page_data = next((p for p in text_data["pages"] if p["page_number"] == selected_page), None)
+    lines_df = lines_by_page.get(selected_page)
 
-    if page_data:
-        st.write(f"**Page {selected_page}** ({len(page_data['lines'])} lines)")
+    if lines_df is not None:
+        st.write(f"**Page {selected_page}** ({len(lines_df)} lines)")
 
-        # Display lines with confidence
-        for line in page_data["lines"]:
-            confidence_color = "🟢" if line["confidence"] > 0.8 else "🟡" if line["confidence"] > 0.6 else "🔴"
-            st.write(f"{confidence_color} {line['content']} *(Confidence: {line['confidence']:.1%})*")
+        # Display lines with confidence, bucketed as <=60% / <=80% / above
+        confidences = lines_df["confidence"].to_numpy(dtype=float)
+        confidence_colors = CONFIDENCE_COLORS[np.digitize(confidences, CONFIDENCE_THRESHOLDS, right=True)]
+        st.markdown("\n\n".join(
+            f"{color} {content} *(Confidence: {confidence:.1%})*"
+            for color, content, confidence in zip(confidence_colors, lines_df["content"], confidences)
+        ))
 
 
 def display_confidence_details(confidence_summary):
@@ -240,12 +412,10 @@ def create_download_section():
     st.subheader("📥 Export Results")
     col1, col2 = st.columns(2)
 
-    processor = DocumentProcessor("dummy", "dummy")  # We only need export methods
-
     with col1:
         # JSON Export
         if st.button("📄 Download JSON", use_container_width=True):
-            json_data = processor.export_to_json(st.session_state.processed_data)
+            json_data = export_to_json(st.session_state.processed_data)
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"document_analysis_{timestamp}.json"
 
@@ -261,7 +431,7 @@ def create_download_section():
         # Excel Export
         if st.button("📊 Download Excel", use_container_width=True):
             try:
-                excel_bytes, _ = processor.export_to_excel(st.session_state.processed_data)
+                excel_bytes, _ = export_to_excel(st.session_state.processed_data)
                 timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                 filename = f"document_analysis_{timestamp}.xlsx"
 
@@ -297,21 +467,58 @@ def main():
     with st.sidebar:
         st.header("📤 Upload Document")
 
-        uploaded_file = st.file_uploader(
-            "Choose a PDF or image file",
-            type=["pdf", "png", "jpg", "jpeg", "bmp", "tiff"],
-            help="Supported formats: PDF, PNG, JPG, JPEG, BMP, TIFF"
-        )
+        batch_mode = st.toggle("Batch Mode", help="Submit several documents at once and collect the results when they are ready")
+
+        if batch_mode:
+            uploaded_file = None
+            uploaded_files = st.file_uploader(
+                "Choose PDF or image files",
+                type=["pdf", "png", "jpg", "jpeg", "bmp", "tiff"],
+                accept_multiple_files=True,
+                help="Supported formats: PDF, PNG, JPG, JPEG, BMP, TIFF"
+            )
+
+            if uploaded_files:
+                st.success(f"✅ {len(uploaded_files)} files uploaded")
+
+                batch_max_pages = st.number_input(
+                    "Analyze first N pages of each PDF",
+                    min_value=1,
+                    value=10,
+                    step=1,
+                    help="Only these pages are sent to Azure, which bills per page"
+                )
+
+                if st.button("🚀 Submit Batch", use_container_width=True):
+                    submit_batch(uploaded_files, config, batch_max_pages)
+        else:
+            uploaded_file = st.file_uploader(
+                "Choose a PDF or image file",
+                type=["pdf", "png", "jpg", "jpeg", "bmp", "tiff"],
+                help="Supported formats: PDF, PNG, JPG, JPEG, BMP, TIFF"
+            )
 
         if uploaded_file:
+            # Read the upload once per rerun; preview and analysis share these bytes
+            document_bytes = uploaded_file.getvalue()
+
             st.success(f"✅ File uploaded: {uploaded_file.name}")
             st.write(f"Size: {uploaded_file.size / 1024:.1f} KB")
             st.write(f"Type: {uploaded_file.type}")
 
+            max_pages = None
+            if uploaded_file.type == "application/pdf":
+                max_pages = st.number_input(
+                    "Analyze first N pages",
+                    min_value=1,
+                    value=10,
+                    step=1,
+                    help="Only these pages are sent to Azure, which bills per page"
+                )
+
             # Process button
             if st.button("🚀 Analyze Document", use_container_width=True):
-                processor = DocumentProcessor(config.endpoint, config.key)
-                process_document(uploaded_file, processor)
+                process_document(uploaded_file, document_bytes, config, max_pages)
 
         # Help section
         st.markdown("---")
@@ -324,13 +531,16 @@ def main():
         """)
 
     # Main content area
-    if uploaded_file:
+    if batch_mode:
+        display_batch_jobs()
+
+    elif uploaded_file:
         # Two-column layout for document and results
         col1, col2 = st.columns([1, 1])
 
         with col1:
             st.header("📄 Original Document")
-            display_document_preview(uploaded_file)
+            display_document_preview(uploaded_file, document_bytes)
 
         with col2:
             st.header("🔍 Extracted Data")
@@ -2,7 +2,15 @@
 Configuration management for Azure Document Intelligence Demo
 """
 import os
-from typing import Optional
+from typing import Callable, Optional
+
+
+def _env_number(name: str, default: float, cast: Callable[[str], float]) -> float:
+    """Read a numeric environment variable, falling back to the default if it is unset or malformed"""
+    try:
+        return cast(os.getenv(name, str(default)))
+    except ValueError:
+        return default
 
 
 class Config:
@@ -19,6 +27,12 @@ class Config:
             self.azure_endpoint = os.getenv('AZURE_DI_ENDPOINT')
             self.azure_key = os.getenv('AZURE_DI_KEY')
 
+        # Throttling limits for calls to the Azure service
+        self.max_concurrency = _env_number('AZURE_DI_CONCURRENCY', 8, int)
+        if self.max_concurrency < 1:
+            self.max_concurrency = 8
+        self.requests_per_second = _env_number('AZURE_DI_RPS', 15.0, float)
+
     def is_configured(self) -> bool:
         """Check if Azure credentials are properly configured"""
         return bool(self.azure_endpoint and self.azure_key)
@@ -42,6 +56,16 @@ class Config:
         """Get Azure Document Intelligence API key"""
         return self.azure_key
 
+    @property
+    def concurrency(self) -> int:
+        """Get maximum number of in-flight Azure analysis requests"""
+        return self.max_concurrency
+
+    @property
+    def rps(self) -> float:
+        """Get maximum Azure analysis requests started per second"""
+        return self.requests_per_second
+
 
 def get_config() -> Config:
     """Factory function to get configuration instance"""
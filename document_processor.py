@@ -1,13 +1,159 @@
 """
 Azure Document Intelligence processing logic
 """
+import array
+import asyncio
 import json
-from typing import Dict, List, Any, Optional, Tuple
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, List, Any, Optional, Tuple
+import fitz
+import numpy as np
 import pandas as pd
-from azure.ai.formrecognizer import DocumentAnalysisClient
+from azure.ai.formrecognizer.aio import DocumentAnalysisClient as AsyncDocumentAnalysisClient
 from azure.core.credentials import AzureKeyCredential
-from azure.core.exceptions import AzureError
+from azure.core.exceptions import AzureError, HttpResponseError
 import streamlit as st
+from tenacity import AsyncRetrying, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+
+from config import get_config
+
+try:
+    import orjson
+except ImportError:
+    # Fall back to the standard library encoder if orjson is not installed
+    orjson = None
+
+
+# Process-wide throttling shared by every Streamlit session. All analyses run on
+# one shared event loop, so the limits are plain asyncio state on that loop:
+# the semaphore caps in-flight operations (held from submission until the
+# result arrives), and the start times are spaced to respect the request rate.
+_config = get_config()
+_MIN_INTERVAL = 1.0 / _config.rps if _config.rps > 0 else 0.0
+_last_call_ts = 0.0
+
+
+def _reserve_start_delay() -> float:
+    """Reserve the next request slot and return how long to wait for it"""
+    # Only called from the shared loop's thread, so no lock is needed
+    global _last_call_ts
+    now = time.monotonic()
+    start = max(now, _last_call_ts + _MIN_INTERVAL)
+    _last_call_ts = start
+    return start - now
+
+
+@asynccontextmanager
+async def _throttle(semaphore: asyncio.Semaphore):
+    """Hold an in-flight slot and respect the request rate"""
+    async with semaphore:
+        await asyncio.sleep(_reserve_start_delay())
+        yield
+
+
+# Retry policy for transient service failures (throttling and 5xx)
+_MAX_ATTEMPTS = 3
+_TRANSIENT_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+def _is_transient(error: BaseException) -> bool:
+    """Check whether an Azure error is worth retrying"""
+    if isinstance(error, HttpResponseError) and error.status_code in _TRANSIENT_STATUS_CODES:
+        return True
+    if isinstance(error, AzureError):
+        message = str(error).lower()
+        return "rate limit" in message or "quota" in message
+    return False
+
+
+def _retrying(on_retry: Optional[Callable[[int], None]] = None) -> AsyncRetrying:
+    """
+    Build the retry controller for one call
+
+    on_retry receives the number of the attempt that failed. It is called
+    instead of touching Streamlit directly, because analysis may run inside
+    st.cache_data or off the script thread.
+    """
+    return AsyncRetrying(
+        retry=retry_if_exception(_is_transient),
+        wait=wait_exponential_jitter(initial=1, max=16),
+        stop=stop_after_attempt(_MAX_ATTEMPTS),
+        before_sleep=(lambda retry_state: on_retry(retry_state.attempt_number)) if on_retry else None,
+        reraise=True
+    )
+
+
+def cells_to_dataframe(cells: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Lay out extracted table cells as a row/column DataFrame"""
+    rows = np.fromiter((cell["row_index"] for cell in cells), dtype=np.intp, count=len(cells))
+    cols = np.fromiter((cell["column_index"] for cell in cells), dtype=np.intp, count=len(cells))
+    contents = np.empty(len(cells), dtype=object)
+    contents[:] = [cell["content"] for cell in cells]
+
+    # Scatter cell content into a matrix pre-filled with empty strings
+    matrix = np.full((rows.max() + 1, cols.max() + 1), "", dtype=object)
+    matrix[rows, cols] = contents
+
+    return pd.DataFrame(matrix)
+
+
+def _split_pdf(pdf_bytes: bytes, page_batch: int) -> List[bytes]:
+    """Split a PDF into consecutive documents of at most page_batch pages each"""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf:
+        if pdf.page_count <= page_batch:
+            return [pdf_bytes]
+
+        chunks = []
+        for start in range(0, pdf.page_count, page_batch):
+            with fitz.open() as chunk:
+                chunk.insert_pdf(pdf, from_page=start, to_page=min(start + page_batch, pdf.page_count) - 1)
+                chunks.append(chunk.tobytes())
+        return chunks
+
+
+def first_pages(pdf_bytes: bytes, max_pages: int) -> bytes:
+    """Return a PDF trimmed to its first max_pages pages, or the input if it is already short enough"""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf:
+        if pdf.page_count <= max_pages:
+            return pdf_bytes
+        pdf.select(list(range(max_pages)))
+        return pdf.tobytes(garbage=3, deflate=True)
+
+
+@st.cache_resource(show_spinner=False)
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    """Start a background event loop that runs every analysis, shared across reruns and sessions"""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="azure-di-event-loop", daemon=True).start()
+    return loop
+
+
+@st.cache_resource(show_spinner=False)
+def _get_semaphore() -> asyncio.Semaphore:
+    """Create the in-flight operation cap on the shared event loop"""
+    async def create_semaphore() -> asyncio.Semaphore:
+        return asyncio.Semaphore(max(1, _config.concurrency))
+
+    return asyncio.run_coroutine_threadsafe(create_semaphore(), _get_event_loop()).result()
+
+
+@st.cache_resource(show_spinner=False)
+def _get_client(endpoint: str, key: str) -> AsyncDocumentAnalysisClient:
+    """
+    Create an async Document Intelligence client shared across reruns and sessions
+
+    The client's aiohttp session is bound to the loop it runs on, so it is
+    created on, and only ever used from, the shared background loop.
+    """
+    async def create_client() -> AsyncDocumentAnalysisClient:
+        return AsyncDocumentAnalysisClient(
+            endpoint=endpoint,
+            credential=AzureKeyCredential(key)
+        )
+
+    return asyncio.run_coroutine_threadsafe(create_client(), _get_event_loop()).result()
 
 
 class DocumentProcessor:
@@ -16,240 +162,418 @@ class DocumentProcessor:
     def __init__(self, endpoint: str, key: str):
         """Initialize the Document Intelligence client"""
         try:
-            self.client = DocumentAnalysisClient(
-                endpoint=endpoint,
-                credential=AzureKeyCredential(key)
-            )
+            self.loop = _get_event_loop()
+            self.semaphore = _get_semaphore()
+            self.client = _get_client(endpoint, key)
         except Exception as e:
             raise Exception(f"Failed to initialize Azure Document Intelligence client: {str(e)}")
 
-    def analyze_document(self, document_bytes: bytes) -> Dict[str, Any]:
+    def analyze_document(self, document_bytes: bytes, on_retry: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
         """
         Analyze document using Azure Document Intelligence prebuilt-document model
 
         Args:
             document_bytes: Document content as bytes
+            on_retry: Called with the failed attempt number before each retry
+
+        Returns:
+            Dict containing extracted data and metadata
+        """
+        return self.run(self.analyze_document_async(document_bytes, on_retry))
+
+    def run(self, coroutine):
+        """Run one of the async analysis coroutines on the shared event loop and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def analyze_document_async(self, document_bytes: bytes, on_retry: Optional[Callable[[int], None]] = None) -> Dict[str, Any]:
+        """
+        Analyze document with the async client so no thread is held while the
+        service runs the long-running operation. Must run on the shared event
+        loop; use run() from synchronous code.
+
+        Args:
+            document_bytes: Document content as bytes
+            on_retry: Called with the failed attempt number before each retry
 
         Returns:
             Dict containing extracted data and metadata
         """
         try:
-            # Use prebuilt-document model for general document analysis
-            poller = self.client.begin_analyze_document(
-                "prebuilt-document",
-                document_bytes
-            )
-            result = poller.result()
-
-            # Extract data
-            extracted_data = {
-                "key_value_pairs": self._extract_key_value_pairs(result),
-                "tables": self._extract_tables(result),
-                "text_content": self._extract_text(result),
-                "pages": len(result.pages),
-                "confidence_summary": self._calculate_confidence_summary(result)
-            }
+            result = await self._invoke_di_async(document_bytes, on_retry)
+            # Every session shares this loop, so CPU-bound work runs in a worker thread
+            return await asyncio.to_thread(self._build_result, result)
+
+        except AzureError as e:
+            raise Exception(f"Azure Document Intelligence analysis failed: {str(e)}")
+        except Exception as e:
+            raise Exception(f"Document analysis failed: {str(e)}")
+
+    async def analyze_document_parallel(
+        self,
+        pdf_bytes: bytes,
+        page_batch: int = 10,
+        on_retry: Optional[Callable[[int], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Analyze a PDF as concurrent page-range requests and merge the results.
+        Must run on the shared event loop; use run() from synchronous code.
+
+        Args:
+            pdf_bytes: PDF content as bytes
+            page_batch: Maximum number of pages sent in each request
+            on_retry: Called with the failed attempt number before each retry of any range
 
-            return extracted_data
+        Returns:
+            Dict containing extracted data and metadata for the whole document
+        """
+        try:
+            # Every session shares this loop, so CPU-bound work runs in a worker thread
+            chunks = await asyncio.to_thread(_split_pdf, pdf_bytes, page_batch)
+
+            tasks = [asyncio.ensure_future(self._invoke_di_async(chunk, on_retry)) for chunk in chunks]
+            try:
+                # gather keeps chunk order, which the merge relies on for page numbering
+                results = await asyncio.gather(*tasks)
+            except BaseException:
+                # Stop the remaining ranges so they free their slots instead of finishing for nothing
+                for task in tasks:
+                    task.cancel()
+                raise
+
+            return await asyncio.to_thread(self._build_result, *results)
 
         except AzureError as e:
             raise Exception(f"Azure Document Intelligence analysis failed: {str(e)}")
         except Exception as e:
             raise Exception(f"Document analysis failed: {str(e)}")
 
-    def _extract_key_value_pairs(self, result) -> List[Dict[str, Any]]:
-        """Extract key-value pairs with confidence scores"""
-        key_value_pairs = []
+    async def analyze_upload(
+        self,
+        document_bytes: bytes,
+        document_type: str,
+        max_pages: Optional[int] = None,
+        on_retry: Optional[Callable[[int], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Analyze an uploaded file the same way whether it came alone or in a batch.
+        PDFs are trimmed to their first max_pages pages and analyzed as concurrent
+        page ranges; images are sent as-is. Must run on the shared event loop;
+        use run() from synchronous code.
 
-        for kv_pair in result.key_value_pairs:
-            if kv_pair.key and kv_pair.value:
-                key_confidence = 0
-                value_confidence = 0
-
-                # Try to get confidence from the key
-                if hasattr(kv_pair.key, 'confidence') and kv_pair.key.confidence is not None:
-                    key_confidence = round(kv_pair.key.confidence, 3)
-                # If not available, try from bounding regions/content
-                elif hasattr(kv_pair, 'confidence') and kv_pair.confidence is not None:
-                    key_confidence = round(kv_pair.confidence, 3)
-
-                # Try to get confidence from the value
-                if hasattr(kv_pair.value, 'confidence') and kv_pair.value.confidence is not None:
-                    value_confidence = round(kv_pair.value.confidence, 3)
-                # If not available, try from bounding regions/content
-                elif hasattr(kv_pair, 'confidence') and kv_pair.confidence is not None:
-                    value_confidence = round(kv_pair.confidence, 3)
-
-                key_value_pairs.append({
-                    "key": kv_pair.key.content,
-                    "value": kv_pair.value.content,
-                    "key_confidence": key_confidence,
-                    "value_confidence": value_confidence
-                })
+        Args:
+            document_bytes: Document content as bytes
+            document_type: MIME type reported by the upload
+            max_pages: Only analyze this many leading pages of a PDF (all pages if None)
+            on_retry: Called with the failed attempt number before each retry
 
-        return key_value_pairs
+        Returns:
+            Dict containing extracted data and metadata
+        """
+        if document_type == "application/pdf":
+            # Only send (and pay for) the pages the user asked for
+            if max_pages:
+                document_bytes = await asyncio.to_thread(first_pages, document_bytes, max_pages)
+            return await self.analyze_document_parallel(document_bytes, on_retry=on_retry)
+        return await self.analyze_document_async(document_bytes, on_retry)
+
+    def submit_batch(
+        self,
+        documents: List[Tuple[str, bytes, str]],
+        max_pages: Optional[int] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Start analysis for several documents without waiting for them to finish
 
-    def _extract_tables(self, result) -> List[Dict[str, Any]]:
-        """Extract tables with structure and confidence scores"""
-        tables = []
+        Each document is scheduled on the shared event loop, where it waits for
+        an in-flight slot like any other analysis.
+
+        Args:
+            documents: List of (document name, document bytes, MIME type)
+            max_pages: Only analyze this many leading pages of each PDF (all pages if None)
 
-        for table_idx, table in enumerate(result.tables):
-            # Safely extract table confidence
-            table_confidence = 0
-            if hasattr(table, 'confidence') and table.confidence is not None:
-                table_confidence = round(table.confidence, 3)
-
-            table_data = {
-                "table_id": table_idx + 1,
-                "row_count": table.row_count,
-                "column_count": table.column_count,
-                "cells": [],
-                "confidence": table_confidence
+        Returns:
+            Dict mapping a job id ("doc_<index>") to its name, pending future and status
+        """
+        return {
+            f"doc_{index}": {
+                "name": name,
+                "future": asyncio.run_coroutine_threadsafe(
+                    self.analyze_upload(document_bytes, document_type, max_pages), self.loop
+                ),
+                "status": "running",
+                "result": None,
+                "error": None
             }
+            for index, (name, document_bytes, document_type) in enumerate(documents)
+        }
 
-            for cell in table.cells:
-                # Safely extract cell confidence
-                cell_confidence = 0
-                if hasattr(cell, 'confidence') and cell.confidence is not None:
-                    cell_confidence = round(cell.confidence, 3)
-
-                table_data["cells"].append({
-                    "content": cell.content,
-                    "row_index": cell.row_index,
-                    "column_index": cell.column_index,
-                    "confidence": cell_confidence
-                })
+    async def _invoke_di_async(self, document_bytes: bytes, on_retry: Optional[Callable[[int], None]] = None):
+        """Run the prebuilt-document model on the async client, retrying transient failures"""
+        async for attempt in _retrying(on_retry):
+            with attempt:
+                # Use prebuilt-document model for general document analysis
+                async with _throttle(self.semaphore):
+                    poller = await self.client.begin_analyze_document(
+                        "prebuilt-document",
+                        document_bytes
+                    )
+                    return await poller.result()
+
+    def _build_result(self, *results) -> Dict[str, Any]:
+        """Convert one or more consecutive AnalyzeResults into the extracted data dict"""
+        extracted_data = self._extract_all(results)
+        extracted_data["pages"] = sum(len(result.pages) for result in results)
+        return extracted_data
+
+    def _extract_all(self, results) -> Dict[str, Any]:
+        """
+        Extract key-value pairs, tables, text and confidence statistics in a single
+        traversal of the analysis results
 
-            tables.append(table_data)
+        Args:
+            results: AnalyzeResults for consecutive page ranges of one document
 
-        return tables
+        Returns:
+            Dict with key_value_pairs, tables, text_content and confidence_summary
+        """
+        # Packed float32 buffer rather than a list of boxed floats
+        all_confidences = array.array('f')
+        key_value_pairs = []
+        tables = []
+        contents = []
+        text_pages = []
+
+        # Page numbers restart at 1 in each result, so shift them by the pages seen so far
+        page_offset = 0
+        for result in results:
+            # Key-value pairs
+            for kv_pair in result.key_value_pairs:
+                # getattr with a default is one lookup, and also covers a missing key/value
+                key_confidence = getattr(kv_pair.key, 'confidence', None)
+                if key_confidence is not None:
+                    all_confidences.append(key_confidence)
+                value_confidence = getattr(kv_pair.value, 'confidence', None)
+                if value_confidence is not None:
+                    all_confidences.append(value_confidence)
+
+                if kv_pair.key and kv_pair.value:
+                    # Fall back to the pair's own confidence when the key/value has none
+                    pair_confidence = getattr(kv_pair, 'confidence', None)
+                    if key_confidence is None:
+                        key_confidence = pair_confidence
+                    if value_confidence is None:
+                        value_confidence = pair_confidence
+
+                    key_value_pairs.append({
+                        "key": kv_pair.key.content,
+                        "value": kv_pair.value.content,
+                        "key_confidence": round(key_confidence, 3) if key_confidence is not None else 0,
+                        "value_confidence": round(value_confidence, 3) if value_confidence is not None else 0
+                    })
 
-    def _extract_text(self, result) -> Dict[str, Any]:
-        """Extract text content with confidence"""
-        text_data = {
-            "content": result.content,
-            "pages": []
-        }
+            # Tables
+            for table in result.tables:
+                table_confidence = getattr(table, 'confidence', None)
+                if table_confidence is not None:
+                    all_confidences.append(table_confidence)
+
+                cells = []
+                for cell in table.cells:
+                    cell_confidence = getattr(cell, 'confidence', None)
+                    if cell_confidence is not None:
+                        all_confidences.append(cell_confidence)
+
+                    cells.append({
+                        "content": cell.content,
+                        "row_index": cell.row_index,
+                        "column_index": cell.column_index,
+                        "confidence": round(cell_confidence, 3) if cell_confidence is not None else 0
+                    })
 
-        for page in result.pages:
-            page_data = {
-                "page_number": page.page_number,
-                "width": page.width,
-                "height": page.height,
-                "unit": page.unit,
-                "lines": []
-            }
+                tables.append({
+                    "table_id": len(tables) + 1,
+                    "row_count": table.row_count,
+                    "column_count": table.column_count,
+                    "cells": cells,
+                    "confidence": round(table_confidence, 3) if table_confidence is not None else 0
+                })
 
-            for line in page.lines:
-                # Safely extract line confidence
-                line_confidence = 0
-                if hasattr(line, 'confidence') and line.confidence is not None:
-                    line_confidence = round(line.confidence, 3)
+            # Text content by page
+            contents.append(result.content)
+            for page in result.pages:
+                lines = []
+                for line in page.lines:
+                    line_confidence = getattr(line, 'confidence', None)
+                    if line_confidence is not None:
+                        all_confidences.append(line_confidence)
+
+                    lines.append({
+                        "content": line.content,
+                        "confidence": round(line_confidence, 3) if line_confidence is not None else 0
+                    })
 
-                page_data["lines"].append({
-                    "content": line.content,
-                    "confidence": line_confidence
+                text_pages.append({
+                    "page_number": page.page_number + page_offset,
+                    "width": page.width,
+                    "height": page.height,
+                    "unit": page.unit,
+                    "lines": lines
                 })
 
-            text_data["pages"].append(page_data)
+            page_offset += len(result.pages)
 
-        return text_data
+        return {
+            "key_value_pairs": key_value_pairs,
+            "tables": tables,
+            "text_content": {
+                "content": "\n".join(contents),
+                "pages": text_pages
+            },
+            "confidence_summary": self._summarize_confidences(all_confidences)
+        }
 
-    def _calculate_confidence_summary(self, result) -> Dict[str, float]:
+    def _summarize_confidences(self, confidences: array.array) -> Dict[str, float]:
         """Calculate overall confidence statistics"""
-        all_confidences = []
-
-        # Collect confidences from key-value pairs
-        for kv_pair in result.key_value_pairs:
-            if kv_pair.key and hasattr(kv_pair.key, 'confidence') and kv_pair.key.confidence is not None:
-                all_confidences.append(kv_pair.key.confidence)
-            if kv_pair.value and hasattr(kv_pair.value, 'confidence') and kv_pair.value.confidence is not None:
-                all_confidences.append(kv_pair.value.confidence)
-
-        # Collect confidences from tables
-        for table in result.tables:
-            if hasattr(table, 'confidence') and table.confidence is not None:
-                all_confidences.append(table.confidence)
-            for cell in table.cells:
-                if hasattr(cell, 'confidence') and cell.confidence is not None:
-                    all_confidences.append(cell.confidence)
-
-        # Collect confidences from text lines
-        for page in result.pages:
-            for line in page.lines:
-                if hasattr(line, 'confidence') and line.confidence is not None:
-                    all_confidences.append(line.confidence)
-
-        if all_confidences:
+        all_confidences = np.frombuffer(confidences, dtype=np.float32)
+
+        if all_confidences.size:
             return {
-                "average": round(sum(all_confidences) / len(all_confidences), 3),
-                "minimum": round(min(all_confidences), 3),
-                "maximum": round(max(all_confidences), 3),
-                "count": len(all_confidences)
+                "average": round(float(all_confidences.mean()), 3),
+                "minimum": round(float(all_confidences.min()), 3),
+                "maximum": round(float(all_confidences.max()), 3),
+                "count": int(all_confidences.size)
             }
         else:
             return {"average": 0, "minimum": 0, "maximum": 0, "count": 0}
 
     def export_to_json(self, data: Dict[str, Any]) -> str:
         """Export extracted data to JSON format"""
-        return json.dumps(data, indent=2, ensure_ascii=False)
+        return export_to_json(data)
 
     def export_to_excel(self, data: Dict[str, Any]) -> Tuple[bytes, Dict[str, pd.DataFrame]]:
-        """
-        Export extracted data to Excel format
+        """Export extracted data to Excel format"""
+        return export_to_excel(data)
 
-        Returns:
-            Tuple of (Excel bytes, DataFrames dict)
-        """
-        dfs = {}
-
-        # Key-Value Pairs sheet
-        if data.get("key_value_pairs"):
-            dfs["Key_Value_Pairs"] = pd.DataFrame(data["key_value_pairs"])
-
-        # Tables sheets
-        for i, table in enumerate(data.get("tables", [])):
-            # Create table structure
-            if table["cells"]:
-                # Create a matrix for the table
-                table_matrix = []
-                max_row = max(cell["row_index"] for cell in table["cells"]) + 1
-                max_col = max(cell["column_index"] for cell in table["cells"]) + 1
-
-                # Initialize matrix with empty strings
-                matrix = [["" for _ in range(max_col)] for _ in range(max_row)]
-
-                # Fill matrix with cell content
-                for cell in table["cells"]:
-                    matrix[cell["row_index"]][cell["column_index"]] = cell["content"]
-
-                dfs[f"Table_{i+1}"] = pd.DataFrame(matrix)
-
-        # Text content sheet
-        if data.get("text_content", {}).get("pages"):
-            text_lines = []
-            for page in data["text_content"]["pages"]:
-                for line in page["lines"]:
-                    text_lines.append({
-                        "page": page["page_number"],
-                        "content": line["content"],
-                        "confidence": line["confidence"]
-                    })
-            if text_lines:
-                dfs["Text_Lines"] = pd.DataFrame(text_lines)
 
-        # Confidence Summary sheet
-        if data.get("confidence_summary"):
-            confidence_df = pd.DataFrame([data["confidence_summary"]])
-            dfs["Confidence_Summary"] = confidence_df
+def poll_batch_results(jobs: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    Collect results for batch jobs whose analysis has finished
+
+    Only the jobs' futures are checked; no request is made to the service.
 
-        # Create Excel file in memory
-        import io
-        excel_buffer = io.BytesIO()
+    Args:
+        jobs: Job dict returned by DocumentProcessor.submit_batch
 
-        with pd.ExcelWriter(excel_buffer, engine='openpyxl') as writer:
-            for sheet_name, df in dfs.items():
-                df.to_excel(writer, sheet_name=sheet_name, index=False)
+    Returns:
+        The same jobs, with finished ones marked succeeded or failed
+    """
+    for job in jobs.values():
+        if job["status"] != "running" or not job["future"].done():
+            continue
 
-        excel_buffer.seek(0)
-        return excel_buffer.getvalue(), dfs
\ No newline at end of file
+        try:
+            job["result"] = job["future"].result()
+            job["status"] = "succeeded"
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+        job["future"] = None
+
+    return jobs
+
+
+def cancel_batch_jobs(jobs: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Cancel batch jobs that are still running, e.g. before a new batch replaces them
+
+    Args:
+        jobs: Job dict returned by DocumentProcessor.submit_batch
+    """
+    for job in jobs.values():
+        if job["status"] == "running":
+            job["future"].cancel()
+            job["status"] = "cancelled"
+            job["future"] = None
+
+
+def export_to_json(data: Dict[str, Any]) -> str:
+    """Export extracted data to JSON format"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(data, indent=2, ensure_ascii=False)
+
+
+def export_to_excel(data: Dict[str, Any]) -> Tuple[bytes, Dict[str, pd.DataFrame]]:
+    """
+    Export extracted data to Excel format
+
+    Returns:
+        Tuple of (Excel bytes, DataFrames dict)
+    """
+    dfs = {}
+
+    # Key-Value Pairs sheet
+    if data.get("key_value_pairs"):
+        dfs["Key_Value_Pairs"] = pd.DataFrame(data["key_value_pairs"])
+
+    # Tables sheets
+    for i, table in enumerate(data.get("tables", [])):
+        # Create table structure
+        if table["cells"]:
+            dfs[f"Table_{i+1}"] = cells_to_dataframe(table["cells"])
+
+    # Text content sheet
+    if data.get("text_content", {}).get("pages"):
+        # Build each column directly rather than one dict per line
+        pages = data["text_content"]["pages"]
+        line_count = sum(len(page["lines"]) for page in pages)
+        if line_count:
+            dfs["Text_Lines"] = pd.DataFrame({
+                "page": pd.Categorical(np.fromiter(
+                    (page["page_number"] for page in pages for _ in page["lines"]),
+                    dtype=np.int32,
+                    count=line_count
+                )),
+                "content": [line["content"] for page in pages for line in page["lines"]],
+                "confidence": np.fromiter(
+                    (line["confidence"] for page in pages for line in page["lines"]),
+                    dtype=np.float64,
+                    count=line_count
+                )
+            })
+
+    # Confidence Summary sheet
+    if data.get("confidence_summary"):
+        confidence_df = pd.DataFrame([data["confidence_summary"]])
+        dfs["Confidence_Summary"] = confidence_df
+
+    # Create Excel file in memory
+    import io
+    excel_buffer = io.BytesIO()
+
+    # constant_memory flushes each row as soon as the next one starts
+    with pd.ExcelWriter(
+        excel_buffer,
+        engine='xlsxwriter',
+        engine_kwargs={"options": {"constant_memory": True}}
+    ) as writer:
+        # Same header look as DataFrame.to_excel
+        header_format = writer.book.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+        for sheet_name, df in dfs.items():
+            _write_sheet(writer, sheet_name, df, header_format)
+
+    excel_buffer.seek(0)
+    return excel_buffer.getvalue(), dfs
+
+
+def _write_sheet(writer: pd.ExcelWriter, sheet_name: str, df: pd.DataFrame, header_format) -> None:
+    """
+    Write a DataFrame to a new sheet strictly in row order
+
+    DataFrame.to_excel emits cells column by column, which loses data once
+    xlsxwriter's constant_memory mode has flushed earlier rows.
+    """
+    worksheet = writer.book.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, list(df.columns), header_format)
+    for row_idx, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        worksheet.write_row(row_idx, 0, row)